@@ -12,6 +12,8 @@ Usage:
 
 import ctypes
 import ctypes.wintypes
+import functools
+import io
 import re
 import sys
 from html.parser import HTMLParser
@@ -37,6 +39,16 @@ except ImportError:
     import pyperclip
 
 URL_RE = re.compile(r'https?://[^\s\)\]>"]+')
+_NBSP_TABLE = {0xA0: 0x20}  # non-breaking space -> regular space
+
+# Byte offsets in the "HTML Format" description header
+START_FRAGMENT_RE = re.compile(rb'StartFragment:(\d+)')
+END_FRAGMENT_RE = re.compile(rb'EndFragment:(\d+)')
+
+# Result table scanning
+TR_RE = re.compile(r'<tr\b[^>]*>(.*?)</tr>', re.DOTALL | re.IGNORECASE)
+TD_RE = re.compile(r'<td\b[^>]*>(.*?)</td>', re.DOTALL | re.IGNORECASE)
+TAG_RE = re.compile(r'<[^>]+>')
 
 
 def get_html_from_clipboard() -> str | None:
@@ -58,8 +70,18 @@ def get_html_from_clipboard() -> str | None:
         if not ptr:
             return None
         try:
-            data = ctypes.string_at(ptr, size)
-            return data.decode("utf-8", errors="replace").rstrip("\x00")
+            # Only copy and decode the fragment the description header points to
+            header = ctypes.string_at(ptr, min(size, 256))
+            start_match = START_FRAGMENT_RE.search(header)
+            end_match = END_FRAGMENT_RE.search(header)
+            start = int(start_match.group(1)) if start_match else -1
+            end = int(end_match.group(1)) if end_match else -1
+            if 0 <= start <= end <= size:
+                data = ctypes.string_at(ptr + start, end - start)
+            else:
+                # Strip the NUL padding before decoding so it is never decoded
+                data = ctypes.string_at(ptr, size).rstrip(b"\x00")
+            return data.decode("utf-8", errors="replace")
         finally:
             kernel32.GlobalUnlock(handle)
     finally:
@@ -68,159 +90,121 @@ def get_html_from_clipboard() -> str | None:
 
 # --- HTML Parsing Helpers ---
 
-class TextExtractor(HTMLParser):
-    """Extract visible text from HTML, converting <p> boundaries to newlines."""
-
-    def __init__(self):
-        super().__init__()
-        self.lines = []
-        self._current_line = []
-        self._skip = False
-
-    def handle_starttag(self, tag, attrs):
-        if tag == "style":
-            self._skip = True
-        if tag in ("p", "br"):
-            self._flush_line()
-
-    def handle_endtag(self, tag):
-        if tag == "style":
-            self._skip = False
-
-    def handle_data(self, data):
-        if not self._skip:
-            self._current_line.append(data)
-
-    def handle_entityref(self, name):
-        self.handle_data(unescape(f"&{name};"))
-
-    def handle_charref(self, name):
-        self.handle_data(unescape(f"&#{name};"))
-
-    def _flush_line(self):
-        text = "".join(self._current_line)
-        if text:
-            self.lines.append(text)
-        self._current_line = []
-
-    def get_text(self) -> str:
-        self._flush_line()
-        return "\n".join(self.lines)
-
+class KustoHtmlExtractor(HTMLParser):
+    """Extract execute links, cluster URL and query text in one pass.
 
-class TableExtractor(HTMLParser):
-    """Extract rows/cells from an HTML <table>."""
+    Links and the cluster URL are only taken from the header, i.e. before
+    <div data-type="query">. The results table is left to extract_table().
+    """
 
     def __init__(self):
         super().__init__()
-        self.rows: list[list[str]] = []
-        self._in_td = False
-        self._current_cell: list[str] = []
-        self._current_row: list[str] = []
+        self.links: list[tuple[str, str]] = []
+        self.cluster_url: str | None = None
+        self._in_header = True
+        self._in_query_div = False
+        self._in_style = False
+        self._query_buf = io.StringIO()
+        self._pending_newline = False
+        self._in_a = False
+        self._current_href: str | None = None
+        self._current_text: list[str] = []
 
     def handle_starttag(self, tag, attrs):
-        if tag == "td":
-            self._in_td = True
-            self._current_cell = []
-        elif tag == "tr":
-            self._current_row = []
-
-    def handle_endtag(self, tag):
-        if tag == "td":
-            self._in_td = False
-            self._current_row.append("".join(self._current_cell).strip())
-        elif tag == "tr":
-            if self._current_row:
-                self.rows.append(self._current_row)
-
-    def handle_data(self, data):
-        if self._in_td:
-            self._current_cell.append(data)
-
-    def handle_entityref(self, name):
-        self.handle_data(unescape(f"&{name};"))
-
-    def handle_charref(self, name):
-        self.handle_data(unescape(f"&#{name};"))
-
-
-def extract_execute_links(html: str) -> list[tuple[str, str]]:
-    """Extract (label, url) pairs from the Execute: [...] line."""
-
-    class LinkExtractor(HTMLParser):
-        def __init__(self):
-            super().__init__()
-            self.links = []
+        if self._in_query_div:
+            if tag == "style":
+                self._in_style = True
+            elif tag in ("p", "br"):
+                self._flush_line()
+            return
+        if tag == "div":
+            if ("data-type", "query") in attrs:
+                self._in_header = False
+                self._in_query_div = True
+        elif tag == "a" and self._in_header:
             self._current_href = None
+            for name, value in attrs:
+                if name == "href":
+                    self._current_href = value
+                    break
+            self._in_a = self._current_href is not None
             self._current_text = []
 
-        def handle_starttag(self, tag, attrs):
-            if tag == "a":
-                attrs_dict = dict(attrs)
-                self._current_href = attrs_dict.get("href")
-                self._current_text = []
-
-        def handle_endtag(self, tag):
-            if tag == "a" and self._current_href:
-                label = "".join(self._current_text).strip()
-                self.links.append((label, unescape(self._current_href)))
-                self._current_href = None
-
-        def handle_data(self, data):
-            if self._current_href is not None:
-                self._current_text.append(data)
-
-    # Get the part before <div data-type="query">
-    query_div_idx = html.find('<div data-type="query">')
-    header_html = html[:query_div_idx] if query_div_idx != -1 else html[:2000]
-
-    extractor = LinkExtractor()
-    extractor.feed(header_html)
-    return extractor.links
-
-
-def extract_query(html: str) -> str | None:
-    """Extract the KQL query text from <div data-type="query">...</div>."""
-    match = re.search(r'<div data-type="query">(.*?)</div>', html, re.DOTALL)
-    if not match:
-        return None
-    query_html = match.group(1)
-    extractor = TextExtractor()
-    extractor.feed(query_html)
-    text = extractor.get_text()
-    # Clean up: replace non-breaking spaces with regular spaces
-    text = text.replace("\xa0", " ")
-    return text.strip() if text.strip() else None
-
-
-def extract_table(html: str) -> list[list[str]] | None:
-    """Extract table rows from the HTML."""
-    table_match = re.search(r'<table[^>]*>(.*?)</table>', html, re.DOTALL)
-    if not table_match:
-        return None
-    extractor = TableExtractor()
-    extractor.feed(table_match.group(1))
-    # Clean up: replace non-breaking spaces
-    for row in extractor.rows:
-        for i in range(len(row)):
-            row[i] = row[i].replace("\xa0", " ")
-    return extractor.rows if extractor.rows else None
+    def handle_endtag(self, tag):
+        if self._in_query_div:
+            if tag == "style":
+                self._in_style = False
+            elif tag == "div":
+                self._flush_line()
+                self._in_query_div = False
+            return
+        if tag == "a" and self._in_a:
+            href = unescape(self._current_href)
+            label = "".join(self._current_text).strip()
+            self.links.append((label, href))
+            if self.cluster_url is None and href.startswith(("http://", "https://")) \
+                    and "query=" not in href:
+                self.cluster_url = href
+            self._in_a = False
+            self._current_href = None
 
+    def handle_data(self, data):
+        if self._in_query_div:
+            if not self._in_style and data:
+                if self._pending_newline and self._query_buf.tell():
+                    self._query_buf.write("\n")
+                self._pending_newline = False
+                self._query_buf.write(data)
+        elif self._in_a:
+            self._current_text.append(data)
 
-def extract_cluster_url(html: str) -> str | None:
-    """Extract the cluster connection URL (not a deep-link with query= param)."""
+    def _flush_line(self):
+        # The newline is written lazily, so empty paragraphs don't add blank lines
+        self._pending_newline = True
+
+    def get_query(self) -> str | None:
+        """Return the KQL query text, or None if there was none."""
+        # Clean up: replace non-breaking spaces with regular spaces
+        text = self._query_buf.getvalue().translate(_NBSP_TABLE)
+        return text.strip() if text.strip() else None
+
+
+def extract_table(table_html: str) -> list[list[str]] | None:
+    """Extract rows/cells from the inside of an HTML <table>."""
+    rows = []
+    for tr in TR_RE.findall(table_html):
+        # Clean up: drop markup, decode entities, replace non-breaking spaces
+        cells = [unescape(TAG_RE.sub("", td)).strip().translate(_NBSP_TABLE)
+                 for td in TD_RE.findall(tr)]
+        if cells:
+            rows.append(cells)
+    return rows if rows else None
+
+
+def parse_kusto_html(html: str):
+    """Return (execute_links, cluster_url, query, table_rows) from Kusto clipboard HTML."""
+    # The results table follows the query div. It is scanned with regexes;
+    # only the markup before it goes through the HTMLParser.
     query_div_idx = html.find('<div data-type="query">')
-    header_html = html[:query_div_idx] if query_div_idx != -1 else html[:3000]
-    matches = re.findall(r'href="(https?://[^"]+)"', header_html)
-    for url in matches:
-        url = unescape(url)
-        if "query=" not in url:
-            return url
-    return None
+    table_start = html.find("<table", max(query_div_idx, 0))
+    table_rows = None
+    if table_start != -1:
+        body_start = html.find(">", table_start) + 1
+        table_end = html.find("</table>", body_start)
+        if table_end == -1:
+            table_end = len(html)
+        table_rows = extract_table(html[body_start:table_end])
+        html = html[:table_start]
+
+    extractor = KustoHtmlExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return extractor.links, extractor.cluster_url, extractor.get_query(), table_rows
 
 
 # --- Markdown Conversion ---
 
+@functools.lru_cache(maxsize=1024)
 def linkify_url(url: str) -> str:
     """Turn a raw URL into a short clickable markdown link."""
     stripped = url.rstrip("/")
@@ -231,14 +215,19 @@ def linkify_url(url: str) -> str:
     return f"[{label}]({url})"
 
 
+def _linkify_match(match: re.Match) -> str:
+    return linkify_url(match.group(0))
+
+
 def rows_to_markdown(rows: list[list[str]]) -> str:
     """Convert table rows to a markdown table. Auto-linkify URL cells."""
     if not rows:
         return ""
     max_cols = max(len(r) for r in rows)
     for row in rows:
-        while len(row) < max_cols:
-            row.append("")
+        deficit = max_cols - len(row)
+        if deficit:
+            row += [""] * deficit
 
     # Escape pipe characters so markdown table renders correctly
     for r in range(len(rows)):
@@ -249,18 +238,25 @@ def rows_to_markdown(rows: list[list[str]]) -> str:
     for r in range(1, len(rows)):
         for c in range(max_cols):
             cell = rows[r][c]
-            if URL_RE.search(cell):
-                rows[r][c] = URL_RE.sub(lambda m: linkify_url(m.group(0)), cell)
+            new = URL_RE.sub(_linkify_match, cell)
+            if new is not cell:  # sub() returns the same object when nothing matched
+                rows[r][c] = new
+
+    # Small tables: skip column alignment, markdown renders them the same
+    if len(rows) * max_cols < 200:
+        header = "| " + " | ".join(rows[0]) + " |"
+        sep = "| " + " | ".join(["---"] * max_cols) + " |"
+        data = ["| " + " | ".join(row) + " |" for row in rows[1:]]
+        return "\n".join([header, sep] + data)
 
-    col_widths = [max(len(rows[r][c]) for r in range(len(rows))) for c in range(max_cols)]
-    col_widths = [max(w, 3) for w in col_widths]
+    col_widths = tuple(max(3, max(map(len, col))) for col in zip(*rows))
 
-    def fmt(row):
-        return "| " + " | ".join(cell.ljust(col_widths[i]) for i, cell in enumerate(row)) + " |"
+    # One format string per table, e.g. "| {:<5} | {:<3} |"
+    fmt = ("| " + " | ".join(f"{{:<{w}}}" for w in col_widths) + " |").format
 
-    header = fmt(rows[0])
+    header = fmt(*rows[0])
     sep = "| " + " | ".join("-" * w for w in col_widths) + " |"
-    data = [fmt(row) for row in rows[1:]]
+    data = [fmt(*row) for row in rows[1:]]
     return "\n".join([header, sep] + data)
 
 
@@ -301,23 +297,20 @@ def main():
 
     if html and "<div data-type=" in html:
         print("Found Kusto Explorer HTML clipboard data.")
-        execute_links = extract_execute_links(html)
-        cluster_url = extract_cluster_url(html)
-        query = extract_query(html)
-        table_rows = extract_table(html)
+        execute_links, cluster_url, query, table_rows = parse_kusto_html(html)
 
         markdown = build_markdown(execute_links, cluster_url, query, table_rows)
     else:
         # Fallback: plain text (tab-separated results only)
         print("No Kusto HTML found, falling back to plain text clipboard.")
         text = pyperclip.paste()
-        if not text or not text.strip():
+        text = text.strip() if text else ""
+        if not text:
             print("Clipboard is empty.")
             return
 
         # Simple TSV conversion
-        lines = [l for l in text.strip().splitlines() if l.strip()]
-        rows = [l.split("\t") for l in lines]
+        rows = [line.split("\t") for line in text.splitlines() if line and not line.isspace()]
         markdown = rows_to_markdown(rows) if rows else ""
 
     if not markdown: